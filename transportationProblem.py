@@ -1,143 +1,265 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
 import gurobipy as gp
 from gurobipy import GRB
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import dijkstra
+
+#introducing parameters for the ferry arc between node 2 and 6, shared by the LP and the closed form
+ferry_distance = 0 #was not exactly sure what to add as the distance between  2 and 6 but kept it as zero since effectively no driving is happening hence no pollution
+ferry_edges = [('2', '6'), ('6', '2')]
+
+def accumulate_flow(predecessors, origin, dests, demands, node_flow):
+    #walking back from every destination and loading its demand onto each edge of the path
+    #scipy marks nodes that cannot be reached with a negative predecessor, the walk stops there
+    for dest, amount in zip(dests, demands):
+        v = dest
+        while v != origin:
+            u = predecessors[v]
+            if u < 0:
+                break
+            node_flow[u, v] += amount
+            v = u
+
+def dense_arrays(nodes, travel_demand, distances):
+    #node labels are mapped to 0..V-1 once so the solvers index numpy arrays instead of hashing tuples
+    node_id = {v: k for k, v in enumerate(nodes)}
+    dist = np.zeros((len(nodes), len(nodes)))
+    for (i, j), d in distances.items():
+        dist[node_id[i], node_id[j]] = d
+    demand = np.zeros((len(nodes), len(nodes)))
+    for (i, j), d in travel_demand.items():
+        demand[node_id[i], node_id[j]] = d
+    return node_id, dist, demand
+
+def edge_endpoints(node_id, edges):
+    #tail and head node of every edge, worked out once so nothing below has to scan the edge list per node
+    tails = np.array([node_id[i] for (i, j) in edges])
+    heads = np.array([node_id[j] for (i, j) in edges])
+    return tails, heads
+
+def build_incidence(num_nodes, tails, heads):
+    #node-edge incidence matrix: +1 where the edge leaves the node, -1 where it enters
+    cols = np.arange(len(tails))
+    return sp.csr_matrix(
+        (np.concatenate([np.ones(len(tails)), -np.ones(len(heads))]),
+         (np.concatenate([tails, heads]), np.concatenate([cols, cols]))),
+        shape=(num_nodes, len(tails))
+    )
+
+def commodity_supplies(node_id, demand, commodities):
+    #net outflow is the demand leaving the origin and minus the demand arriving at each destination
+    #intermediate nodes are left at zero which conserves flow through them
+    supplies = np.zeros((len(commodities), len(node_id)))
+    for k, details in enumerate(commodities.values()):
+        origin = node_id[details['origin']]
+        dests = [node_id[dest] for dest in details['destinations']]
+        supplies[k, origin] += demand[origin, dests].sum()
+        supplies[k, dests] -= demand[origin, dests]
+    return supplies
 
-def solve_multicommodity_flow(nodes, edges, travel_demand, distances, with_ferry=False):
-    model = gp.Model("MultiCommodityTransportationPlanning")
+def build_model(node_id, edges, demand, dist, commodities, env=None, verbose=False, log_file=None):
+    #a separate env lets this model be built and solved alongside other gurobi work
+    model = gp.Model("MultiCommodityTransportationPlanning", env=env)
     
-    #commoditifying traffic from each origin node
-    commodities = {
-        'O1': {'origin': '1', 'destinations': ['2', '3', '4', '5', '6', '7']},
-        'O4': {'origin': '4', 'destinations': ['1', '2', '3', '5', '6', '7']},
-        'O5': {'origin': '5', 'destinations': ['1', '2', '3', '4', '6', '7']}
-    }
+    #the solver log only goes to the console when verbose, log_file still captures it for debugging
+    model.Params.LogToConsole = 1 if verbose else 0
+    if log_file:
+        model.Params.LogFile = log_file
     
-    #introducing parameters for the ferry arc between node 2 and 6
-    if with_ferry:
-        ferry_distance = 0 #was not exactly sure what to add as the distance between  2 and 6 but kept it as zero since effectively no driving is happening hence no pollution
-        distances[('2', '6')] = ferry_distance
-        distances[('6', '2')] = ferry_distance
-        edges.append(('2', '6'))
-        edges.append(('6', '2'))
+    #the model is tiny, so skip the concurrent method selection and extra threads
+    #dual simplex is used since it restarts well if a caller re-solves for another ferry capacity
+    model.Params.Method = 1
+    model.Params.Presolve = 1
+    model.Params.Threads = 1
     
-    #introducing the flow varables
-    flow = {}
-    for commodity, details in commodities.items():
-        for (i, j) in edges:
-            flow[commodity, i, j] = model.addVar(lb=0, vtype=GRB.CONTINUOUS, 
-                                                 name=f'flow_{commodity}_{i}_{j}')#flow from i to j for particular commodity
+    #the ferry arcs are always part of the model, their capacity is only the upper bound of ferry_vars
+    #so a caller can re-solve the same model for other capacities (0 closes the ferry)
+    #the inputs are never modified, the ferry arcs only exist in the model's own edge list
+    edges = edges + ferry_edges
+    ferry_cols = list(range(len(edges) - len(ferry_edges), len(edges)))
+    
+    tails, heads = edge_endpoints(node_id, edges)
+    incidence = build_incidence(len(node_id), tails, heads)
     
     #objective functions: minimize the total distance travelled 
-    model.setObjective(
-        gp.quicksum(flow[commodity, i, j] * distances.get((i, j), 0) 
-                    for commodity, details in commodities.items() 
-                    for (i, j) in edges 
-                    if (i, j) in distances),
-        GRB.MINIMIZE
-    )
+    dist_vec = dist[tails, heads]
+    dist_vec[ferry_cols] = ferry_distance
+    
+    #introducing the flow varables, one row per commodity and one column per edge
+    #the distances are passed as obj so the objective is written while the variables are created
+    flow = model.addMVar(shape=(len(commodities), len(edges)), lb=0.0,
+                         obj=np.tile(dist_vec, (len(commodities), 1)), name='flow')
+    model.ModelSense = GRB.MINIMIZE
     
     #flow constraints
-    for commodity, details in commodities.items():
-        origin = details['origin']
-        for node in nodes:
-            #balancing inward and outward flow at each node conserving flow
-            flow_in = gp.quicksum(flow[commodity, i, node] 
-                                  for i in nodes if (i, node) in edges)
-            flow_out = gp.quicksum(flow[commodity, node, j] 
-                                   for j in nodes if (node, j) in edges)
-            
-            if node == origin:
-                #traffic from origin nodes can be considered as the demand in the scenario
-                model.addConstr(
-                    flow_out - flow_in == 
-                    gp.quicksum(travel_demand.get((origin, dest), 0) 
-                                for dest in details['destinations']),
-                    f'flow_conservation_{commodity}_{node}'
-                )
-            elif node in details['destinations']:
-                model.addConstr(
-                    flow_in - flow_out == 
-                    travel_demand.get((origin, node), 0),
-                    f'flow_conservation_{commodity}_{node}'
-                )
-            else:
-                #conserving flow at intermediate nodes
-                model.addConstr(
-                    flow_in == flow_out, 
-                    f'flow_conservation_{commodity}_{node}'
-                )
+    #one block of the incidence matrix per commodity so all conservation rows go in with a single call
+    supplies = commodity_supplies(node_id, demand, commodities)
+    model.addMConstr(sp.block_diag([incidence] * len(commodities), format='csr'),
+                     flow.reshape(-1), '=', supplies.reshape(-1), name='flow_conservation')
     
     #constraints for the ferry
-    if with_ferry:
-        #code did not work accurately until i added a constraint of less than or equal to 2000 in both directions
-        model.addConstr(
-            gp.quicksum(flow[commodity, '2', '6'] 
-                        for commodity in commodities.keys()) <= 2000,
-            'ferry_2_to_6_capacity_constraint'
-        )
-        model.addConstr(
-            gp.quicksum(flow[commodity, '6', '2'] 
-                        for commodity in commodities.keys()) <= 2000,
-            'ferry_6_to_2_capacity_constraint'
-        )
+    #ferry_vars holds the total flow over 2 -> 6 and 6 -> 2, its upper bound is the ferry capacity
+    ferry_vars = model.addMVar(shape=len(ferry_cols), lb=0.0, ub=0.0, name='ferry')
+    #each sum over commodities is written straight from its coefficients rather than summed up term by term
+    ones = [1.0] * len(commodities)
+    for a, (col, (i, j)) in enumerate(zip(ferry_cols, ferry_edges)):
+        model.addLConstr(gp.LinExpr(ones + [-1.0], flow[:, col].tolist() + [ferry_vars[a].item()]),
+                         GRB.EQUAL, 0.0, f'ferry_{i}_to_{j}_capacity_constraint')
+    
+    return model, flow, ferry_vars, edges
+
+def solve_shortest_paths(node_id, edges, demand, dist, commodities):
+    #without the ferry nothing couples the commodities and there are no capacities,
+    #so every trip simply takes its shortest path and no LP is needed
+    tails, heads = edge_endpoints(node_id, edges)
+    graph = sp.csr_matrix((dist[tails, heads], (tails, heads)),
+                          shape=(len(node_id), len(node_id)))
+    
+    origins = [node_id[details['origin']] for details in commodities.values()]
+    dist_matrix, predecessors = dijkstra(graph, indices=origins, return_predecessors=True)
+    
+    total_distance = 0
+    flow_values = np.zeros((len(commodities), len(edges)))
+    for k, details in enumerate(commodities.values()):
+        dests = np.array([node_id[dest] for dest in details['destinations']])
+        demands = demand[origins[k], dests]
+        #a destination with demand that cannot be reached means there is no feasible flow
+        if np.isinf(dist_matrix[k, dests][demands > 0]).any():
+            return None, None
+        total_distance += demands[demands > 0] @ dist_matrix[k, dests][demands > 0]
+        node_flow = np.zeros((len(node_id), len(node_id)))
+        accumulate_flow(predecessors[k], origins[k], dests, demands, node_flow)
+        flow_values[k] = node_flow[tails, heads]
+    
+    return total_distance, flow_values
+
+def solve_ferry_closed_form(node_id, edges, demand, dist, commodities, ferry_capacity=0):
+    #for this network every trip either drives its land route or drives to one ferry terminal,
+    #crosses and drives on from the other, so no LP is needed:
+    #each ferry direction is filled with the trips that save the most kilometres per vehicle
+    tails, heads = edge_endpoints(node_id, edges)
+    graph = sp.csr_matrix((dist[tails, heads], (tails, heads)),
+                          shape=(len(node_id), len(node_id)))
+    d_land, predecessors = dijkstra(graph, return_predecessors=True)
+    terminals = [(node_id[i], node_id[j]) for (i, j) in ferry_edges]
+    
+    #only the trips the commodities route, the same ones the LP sees
+    trips = []
+    for k, details in enumerate(commodities.values()):
+        origin = node_id[details['origin']]
+        for dest in details['destinations']:
+            if demand[origin, node_id[dest]] > 0:
+                trips.append((k, origin, node_id[dest]))
+    
+    #savings of every (trip, ferry direction) option, largest first
+    options = []
+    for t, (k, o, d) in enumerate(trips):
+        for f, (a, b) in enumerate(terminals):
+            via_ferry = d_land[o, a] + ferry_distance + d_land[b, d]
+            if via_ferry < d_land[o, d]:
+                options.append((d_land[o, d] - via_ferry, t, f))
+    options.sort(key=lambda option: option[0], reverse=True)
+    
+    total_distance = 0
+    remaining_capacity = [ferry_capacity] * len(ferry_edges)
+    remaining_demand = [demand[o, d] for (k, o, d) in trips]
+    node_flow = np.zeros((len(commodities), len(node_id), len(node_id)))
+    ferry_flow = np.zeros((len(commodities), len(ferry_edges)))
+    for _, t, f in options:
+        moved = min(remaining_capacity[f], remaining_demand[t])
+        if moved <= 0:
+            continue
+        k, o, d = trips[t]
+        a, b = terminals[f]
+        remaining_capacity[f] -= moved
+        remaining_demand[t] -= moved
+        ferry_flow[k, f] += moved
+        accumulate_flow(predecessors[o], o, [a], [moved], node_flow[k])
+        accumulate_flow(predecessors[b], b, [d], [moved], node_flow[k])
+        total_distance += moved * (d_land[o, a] + ferry_distance + d_land[b, d])
     
+    #whatever did not fit on the ferry drives its land route
+    for t, (k, o, d) in enumerate(trips):
+        if remaining_demand[t] <= 0:
+            continue
+        if np.isinf(d_land[o, d]):
+            return None, None
+        accumulate_flow(predecessors[o], o, [d], [remaining_demand[t]], node_flow[k])
+        total_distance += remaining_demand[t] * d_land[o, d]
     
+    #columns follow edges + ferry_edges, the same order as the LP's edge list
+    flow_values = np.hstack([node_flow[:, tails, heads], ferry_flow])
+    return total_distance, flow_values
+
+def solve_multicommodity_flow(model, flow, ferry_vars, ferry_capacity=0):
+    #code did not work accurately until i added a constraint of less than or equal to 2000 in both directions
+    #the capacity is only a bound on ferry_vars, callers re-solving for another capacity start from the previous basis
+    ferry_vars.UB = ferry_capacity
     model.optimize()
     
     #calculating total distance travelled without the ferry
     if model.status == GRB.OPTIMAL:
         total_distance = model.objVal
-        print(f"{'With Ferry' if with_ferry else 'Without Ferry'}:")
-        print(f"Total Driving Distance: {total_distance:.2f} kilometres")
+        #all flow values come back from gurobi in one bulk attribute query
+        flow_values = flow.getAttr(GRB.Attr.X)
+        return total_distance, flow_values
+    else:
+        #nothing is printed here since this can run in a worker thread, the caller reports it
+        return None, None
+
+def report_flows(edges, commodities, flow_values, total_distance, with_ferry):
+    edge_idx = {e: k for k, e in enumerate(edges)}
+    commodity_names = list(commodities.keys())
+    
+    #the report is collected and written in one go instead of one print per line
+    lines = []
+    lines.append(f"{'With Ferry' if with_ferry else 'Without Ferry'}:")
+    lines.append(f"Total Driving Distance: {total_distance:.2f} kilometres")
+    
+    #edge flows for each edge, only edges carrying some commodity are visited
+    used = flow_values > 1e-6
+    edge_totals = np.where(used, flow_values, 0).sum(axis=0)
+    lines.append("\nEdge Flows:")
+    for e in np.flatnonzero(used.any(axis=0)):
+        i, j = edges[e]
+        lines.append(f"Edge {i} -> {j}:")
+        lines.append(f"  Total Flow: {edge_totals[e]:.2f}")
+        for k in np.flatnonzero(used[:, e]):
+            lines.append(f"    {commodity_names[k]}: {flow_values[k, e]:.2f}")
+    
+    #adding in the ferry arc
+    if with_ferry:
+        lines.append("\nFerry Usage:")
+        ferry_2_to_6_flows = {}
+        ferry_6_to_2_flows = {}
         
-        #edge flows for each edge, we iterate through each edge in this for loop
-        print("\nEdge Flows:")
-        for (i, j) in edges:
-            edge_flows = {}
-            for commodity in commodities.keys():
-                flow_value = flow[commodity, i, j].x
-                if flow_value > 1e-6:
-                    edge_flows[commodity] = flow_value
+        for k, commodity in enumerate(commodity_names):
+            flow_2_to_6 = flow_values[k, edge_idx[('2', '6')]]
+            flow_6_to_2 = flow_values[k, edge_idx[('6', '2')]]
             
-            if edge_flows:
-                edge_total_flow = sum(edge_flows.values())
-                print(f"Edge {i} -> {j}:")
-                print(f"  Total Flow: {edge_total_flow:.2f}")
-                for commodity, value in edge_flows.items():
-                    print(f"    {commodity}: {value:.2f}")
+            if flow_2_to_6 > 1e-6:
+                ferry_2_to_6_flows[commodity] = flow_2_to_6
+            if flow_6_to_2 > 1e-6:
+                ferry_6_to_2_flows[commodity] = flow_6_to_2
         
-        #adding in the ferry arc
-        if with_ferry:
-            print("\nFerry Usage:")
-            ferry_2_to_6_flows = {}
-            ferry_6_to_2_flows = {}
-            
-            for commodity in commodities.keys():
-                flow_2_to_6 = flow[commodity, '2', '6'].x
-                flow_6_to_2 = flow[commodity, '6', '2'].x
-                
-                if flow_2_to_6 > 1e-6:
-                    ferry_2_to_6_flows[commodity] = flow_2_to_6
-                if flow_6_to_2 > 1e-6:
-                    ferry_6_to_2_flows[commodity] = flow_6_to_2
-            
-            print("2 -> 6 Ferry Flows:")
-            total_2_to_6_flow = 0
-            for commodity, value in ferry_2_to_6_flows.items():
-                print(f"  {commodity}: {value:.2f}")
-                total_2_to_6_flow += value
-            print(f"Total 2 -> 6 Flow: {total_2_to_6_flow:.2f}")
-            
-            print("\n6 -> 2 Ferry Flows:")
-            total_6_to_2_flow = 0
-            for commodity, value in ferry_6_to_2_flows.items():
-                print(f"  {commodity}: {value:.2f}")
-                total_6_to_2_flow += value
-            print(f"Total 6 -> 2 Flow: {total_6_to_2_flow:.2f}")
+        lines.append("2 -> 6 Ferry Flows:")
+        total_2_to_6_flow = 0
+        for commodity, value in ferry_2_to_6_flows.items():
+            lines.append(f"  {commodity}: {value:.2f}")
+            total_2_to_6_flow += value
+        lines.append(f"Total 2 -> 6 Flow: {total_2_to_6_flow:.2f}")
         
-        return total_distance
-    else:
-        print("No optimal solution available")
-        return None
+        lines.append("\n6 -> 2 Ferry Flows:")
+        total_6_to_2_flow = 0
+        for commodity, value in ferry_6_to_2_flows.items():
+            lines.append(f"  {commodity}: {value:.2f}")
+            total_6_to_2_flow += value
+        lines.append(f"Total 6 -> 2 Flow: {total_6_to_2_flow:.2f}")
+    
+    sys.stdout.write('\n'.join(lines) + '\n')
 
 #defining all our parameters
 nodes = ['1', '2', '3', '4', '5', '6', '7']
@@ -160,25 +282,66 @@ distances = {
     ('5', '6'): 4.0, ('6', '5'): 4.0, 
     ('6', '7'): 2.5, ('7', '6'): 2.5
 }
+ferry_capacity = 2000
+
+#the ferry scenario is solved in closed form, set to True to solve it with the gurobi LP instead
+use_lp = False
+
+#set to True to see the gurobi log
+verbose = False
+
+
+#commoditifying traffic from each origin node
+commodities = {
+    'O1': {'origin': '1', 'destinations': ['2', '3', '4', '5', '6', '7']},
+    'O4': {'origin': '4', 'destinations': ['1', '2', '3', '5', '6', '7']},
+    'O5': {'origin': '5', 'destinations': ['1', '2', '3', '4', '6', '7']}
+}
 
+#switching to integer node ids and dense distance and demand matrices once for both scenarios
+node_id, dist, demand = dense_arrays(nodes, travel_demand, distances)
+
+if use_lp:
+    #the env is started with console logging already switched off so not even its banner is printed
+    env = gp.Env(empty=True)
+    env.setParam('LogToConsole', 1 if verbose else 0)
+    env.start()
+    
+    #the two scenarios are independent so they are solved at the same time
+    #the shortest paths run in a worker thread while the ferry model is built, gurobi releases the GIL while optimizing
+    with env, ThreadPoolExecutor(max_workers=2) as executor:
+        #without the ferry every trip takes its shortest path
+        without_ferry = executor.submit(solve_shortest_paths, node_id, edges, demand, dist, commodities)
+        
+        #the ferry capacity couples the commodities so the full multi-commodity model is needed
+        #it is built once, further capacities only need another solve_multicommodity_flow call
+        model, flow, ferry_vars, model_edges = build_model(node_id, edges, demand, dist, commodities,
+                                                         env=env, verbose=verbose)
+        with_ferry = executor.submit(solve_multicommodity_flow, model, flow, ferry_vars, ferry_capacity)
+        
+        distance_without_ferry, flows_without_ferry = without_ferry.result()
+        distance_with_ferry, flows_with_ferry = with_ferry.result()
+        model.dispose()
+else:
+    #without the ferry every trip takes its shortest path
+    distance_without_ferry, flows_without_ferry = solve_shortest_paths(node_id, edges, demand, dist, commodities)
+    
+    model_edges = edges + ferry_edges
+    distance_with_ferry, flows_with_ferry = solve_ferry_closed_form(node_id, edges, demand, dist,
+                                                                   commodities, ferry_capacity)
 
+#reporting afterwards so the two scenarios print in order
 print("Scenario 1: Without Ferry")
-distance_without_ferry = solve_multicommodity_flow(
-    nodes.copy(), 
-    edges.copy(), 
-    travel_demand.copy(), 
-    distances.copy(), 
-    with_ferry=False
-)
+if distance_without_ferry is not None:
+    report_flows(edges, commodities, flows_without_ferry, distance_without_ferry, with_ferry=False)
+else:
+    print("No optimal solution available")
 
 print("\nScenario 2: With Ferry")
-distance_with_ferry = solve_multicommodity_flow(
-    nodes.copy(), 
-    edges.copy(), 
-    travel_demand.copy(), 
-    distances.copy(), 
-    with_ferry=True
-)
+if distance_with_ferry is not None:
+    report_flows(model_edges, commodities, flows_with_ferry, distance_with_ferry, with_ferry=True)
+else:
+    print("No optimal solution available")
 
 #logic to calculate total reduced distance
 if distance_without_ferry is not None and distance_with_ferry is not None: